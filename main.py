@@ -8,45 +8,199 @@ from database import search_stocks
 import random
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import io
+from concurrent.futures import ThreadPoolExecutor
 
 NYT_API_KEY = os.environ.get('NYT_API_KEY')
 
+# Series shorter than this render faster as SVG than through a WebGL context
+SCATTERGL_MIN_POINTS = 1000
+
+# Long series are downsampled to roughly the chart's pixel width before plotting
+LTTB_POINTS = 1500
+
+MARKET_CAP_UNITS = ((1e12, 'T'), (1e9, 'B'), (1e6, 'M'), (1, ''))
+
+DATE_RANGE_DELTAS = {
+    '1D': timedelta(days=1),
+    '5D': timedelta(days=5),
+    '6M': timedelta(days=180),
+    '1 Year': timedelta(days=365),
+    '5 Years': timedelta(days=365*5),
+    '10 Years': timedelta(days=365*10),
+    '15 Years': timedelta(days=365*15),
+    '20 Years': timedelta(days=365*20),
+    '30 Years': timedelta(days=365*30),
+}
+
 def calculate_returns(data, start_date, end_date):
-    start_date = data.index[data.index >= pd.Timestamp(start_date)][0]
-    end_date = data.index[data.index <= pd.Timestamp(end_date)][-1]
-    start_price = data.loc[start_date, 'Close']
-    end_price = data.loc[end_date, 'Close']
+    index = data.index
+    start_pos = index.searchsorted(pd.Timestamp(start_date), side='left') if start_date is not None else 0
+    end_pos = index.searchsorted(pd.Timestamp(end_date), side='right') - 1
+    if start_pos > end_pos:
+        raise ValueError("No trading days in the selected date range")
+    start_price = data['Close'].iat[start_pos]
+    end_price = data['Close'].iat[end_pos]
     total_return = (end_price - start_price) / start_price
-    years = (end_date - start_date).days / 365.25
+    years = (index[end_pos] - index[start_pos]).days / 365.25
     cagr = (1 + total_return) ** (1 / years) - 1 if years > 0 else 0
     return total_return, cagr
 
+def get_date_range(selected_range):
+    end_date = datetime.now().date()
+    if selected_range in DATE_RANGE_DELTAS:
+        start_date = end_date - DATE_RANGE_DELTAS[selected_range]
+    elif selected_range == 'MTD':
+        start_date = end_date.replace(day=1)
+    elif selected_range == 'YTD':
+        start_date = end_date.replace(month=1, day=1)
+    elif selected_range == 'Maximum':
+        start_date = None
+    else:  # Custom
+        start_date = st.sidebar.date_input("Start date", end_date - timedelta(days=365))
+        end_date = st.sidebar.date_input("End date", end_date)
+    return start_date, end_date
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_stock_data(symbols, start_date, end_date):
+    raw = yf.download(list(symbols), start=start_date, end=end_date, group_by='ticker',
+                      threads=True, auto_adjust=False, progress=False)
+    if not isinstance(raw.columns, pd.MultiIndex):
+        raw = pd.concat({symbols[0].upper(): raw}, axis=1)
+    data = {}
+    for symbol in symbols:
+        # yfinance upper-cases tickers before requesting them
+        if symbol.upper() in raw.columns.get_level_values(0):
+            stock_data = raw[symbol.upper()].dropna(how='all')
+            # Aligning tickers with different calendars adds NaN rows, which turn Volume into floats
+            if 'Volume' in stock_data.columns and stock_data['Volume'].notna().all():
+                stock_data = stock_data.astype({'Volume': np.int64})
+            # Multi-ticker downloads come back with a UTC index; keep it naive like single downloads
+            if stock_data.index.tz is not None:
+                stock_data.index = stock_data.index.tz_localize(None)
+            if not stock_data.empty:
+                data[symbol] = stock_data
+    if not data:
+        # yfinance swallows per-ticker failures; raise so an empty result is not cached
+        raise ValueError(f"No data returned for {', '.join(symbols)} in the selected date range")
+    return data
+
+# Largest-Triangle-Three-Buckets: keep `threshold` points that preserve the visual shape
+def downsample_lttb(x, y, threshold):
+    n = len(y)
+    if n <= threshold or threshold < 3:
+        return x, y
+    xs = x.astype(np.int64).astype(np.float64)
+    xs -= xs[0]
+    ys = y.astype(np.float64)
+    # threshold - 2 buckets between the fixed first and last points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (hi, edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = xs[next_lo:next_hi].mean()
+        avg_y = ys[next_lo:next_hi].mean()
+        areas = np.abs((xs[a] - avg_x) * (ys[lo:hi] - ys[a]) - (xs[a] - xs[lo:hi]) * (avg_y - ys[a]))
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def build_chart_traces(symbols, start_date, end_date):
+    data = get_stock_data(symbols, start_date, end_date)
+    symbols = [symbol for symbol in symbols if symbol in data]
+
+    # Align all closes on one index so the per-symbol math runs as whole-frame operations
+    # float32 is plenty for plotting and halves the trace payload; the source frames stay float64
+    closes = pd.concat({symbol: data[symbol]['Close'] for symbol in symbols}, axis=1).astype(np.float32)
+    start_prices = closes.bfill().iloc[0]
+    end_prices = closes.ffill().iloc[-1]
+    observed = closes.notna()
+    years = (observed[::-1].idxmax() - observed.idxmax()).dt.days / 365.25
+    # Calculate CAGR for the timeframe
+    cagrs = ((end_prices / start_prices) ** (1 / years.where(years > 0)) - 1).mul(100).fillna(0)
+
+    if len(symbols) > 1:
+        # Calculate percentage change relative to the starting point
+        y_frame = closes.div(start_prices).sub(1).mul(100)
+    else:
+        y_frame = closes
+
+    traces = []
+    for symbol in symbols:
+        y_values = y_frame[symbol].dropna()
+        x, y = downsample_lttb(y_values.index.values, y_values.to_numpy(), LTTB_POINTS)
+        traces.append({
+            'x': x,
+            'y': y,
+            'name': symbol,
+            'cagr': float(cagrs[symbol])
+        })
+    return traces
+
 def generate_random_color():
     return f"#{random.randint(0, 0xFFFFFF):06x}"
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def export_to_csv(df):
-    csv = df.to_csv(index=True)
-    return csv
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=True)
+    return buffer.getvalue()
 
 def export_news_to_csv(news_data):
     df = pd.DataFrame(news_data, columns=['Headline', 'Published Date', 'Abstract', 'URL'])
     csv = df.to_csv(index=False)
     return csv
 
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_ticker(symbol):
+    return yf.Ticker(symbol)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_info(symbol):
+    return get_ticker(symbol).info
+
+def fetch_market_cap(symbol):
+    try:
+        return get_ticker(symbol).fast_info['marketCap'] or 0
+    except Exception as e:
+        print(f"Error fetching market cap for {symbol}: {str(e)}")
+        return 0
+
+def format_market_cap(market_cap):
+    scale, suffix = next(((scale, suffix) for scale, suffix in MARKET_CAP_UNITS if market_cap >= scale),
+                         MARKET_CAP_UNITS[-1])
+    return f"{market_cap/scale:.2f}{suffix}"
+
 def get_company_name(symbol):
     try:
-        ticker = yf.Ticker(symbol)
-        company_name = ticker.info.get('longName', symbol)
+        company_name = fetch_info(symbol).get('longName', symbol)
         return company_name
     except Exception as e:
         print(f"Error fetching company name for {symbol}: {str(e)}")
         return symbol
 
-def fetch_news(symbol, historical_news_date, keyword=""):
+@st.cache_resource(show_spinner=False)
+def get_nyt_session():
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'stocks-price-and-headline/0.1'})
+    session.mount('https://', HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                          raise_on_status=False)
+    ))
+    return session
+
+def request_news(search_query, historical_news_date):
     url = f"https://api.nytimes.com/svc/search/v2/articlesearch.json"
-    search_query = keyword if keyword else get_company_name(symbol)
     params = {
         "api-key": NYT_API_KEY,
         "q": search_query,
@@ -54,12 +208,27 @@ def fetch_news(symbol, historical_news_date, keyword=""):
         "end_date": (historical_news_date + timedelta(days=1)).strftime('%Y%m%d'),
         "sort": "relevance"
     }
-    response = requests.get(url, params=params)
+    response = get_nyt_session().get(url, params=params, timeout=10)
     if response.status_code != 200:
-        st.error(f"Error fetching news: {response.status_code} - {response.text}")
-        return None
+        # Raise instead of returning so failed responses are not cached
+        raise requests.HTTPError(f"{response.status_code} - {response.text}", response=response)
     return response.json()
 
+# Headlines for a past date are settled; today's can still change during the day
+@st.cache_data(ttl=86400, show_spinner=False)
+def fetch_past_news(search_query, historical_news_date):
+    return request_news(search_query, historical_news_date)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_recent_news(search_query, historical_news_date):
+    return request_news(search_query, historical_news_date)
+
+def fetch_news(search_query, historical_news_date):
+    # The query's end_date is the following day and NYT treats it as inclusive
+    if historical_news_date + timedelta(days=1) < datetime.now().date():
+        return fetch_past_news(search_query, historical_news_date)
+    return fetch_recent_news(search_query, historical_news_date)
+
 def main():
     st.set_page_config(layout="wide")
     st.title("Interactive Stock Price Chart with News Headlines")
@@ -79,59 +248,27 @@ def main():
     date_ranges = ['1D', '5D', 'MTD', '6M', 'YTD', '1 Year', '5 Years', '10 Years', '15 Years', '20 Years', '30 Years', 'Maximum', 'Custom']
     selected_range = st.sidebar.selectbox("Select Date Range", date_ranges, index=date_ranges.index('YTD'))
 
-    def get_date_range(selected_range):
-        end_date = datetime.now().date()
-        if selected_range == '1D':
-            start_date = end_date - timedelta(days=1)
-        elif selected_range == '5D':
-            start_date = end_date - timedelta(days=5)
-        elif selected_range == 'MTD':
-            start_date = end_date.replace(day=1)
-        elif selected_range == '6M':
-            start_date = end_date - timedelta(days=180)
-        elif selected_range == 'YTD':
-            start_date = end_date.replace(month=1, day=1)
-        elif selected_range == '1 Year':
-            start_date = end_date - timedelta(days=365)
-        elif selected_range == '5 Years':
-            start_date = end_date - timedelta(days=365*5)
-        elif selected_range == '10 Years':
-            start_date = end_date - timedelta(days=365*10)
-        elif selected_range == '15 Years':
-            start_date = end_date - timedelta(days=365*15)
-        elif selected_range == '20 Years':
-            start_date = end_date - timedelta(days=365*20)
-        elif selected_range == '30 Years':
-            start_date = end_date - timedelta(days=365*30)
-        elif selected_range == 'Maximum':
-            start_date = None
-        else:  # Custom
-            start_date = st.sidebar.date_input("Start date", end_date - timedelta(days=365))
-            end_date = st.sidebar.date_input("End date", end_date)
-        return start_date, end_date
-
     start_date, end_date = get_date_range(selected_range)
 
     # Fetch stock data
+    symbols_key = tuple(selected_symbols)
     data = {}
     with st.spinner('Fetching stock data...'):
-        for symbol in selected_symbols:
-            try:
-                if show_debug:
-                    with debug_container.container():
-                        st.text(f"Fetching data for {symbol}...")
-                start_time = time.time()
-                stock_data = yf.download(symbol, start=start_date, end=end_date)
-                end_time = time.time()
-                if show_debug:
-                    with debug_container.container():
-                        st.text(f"Fetched data for {symbol} in {end_time - start_time:.2f} seconds")
-                if not stock_data.empty:
-                    data[symbol] = stock_data
-                else:
+        try:
+            if show_debug:
+                with debug_container.container():
+                    st.text(f"Fetching data for {', '.join(selected_symbols)}...")
+            start_time = time.time()
+            data = get_stock_data(symbols_key, start_date, end_date)
+            end_time = time.time()
+            if show_debug:
+                with debug_container.container():
+                    st.text(f"Fetched data for {len(data)} symbols in {end_time - start_time:.2f} seconds")
+            for symbol in selected_symbols:
+                if symbol not in data:
                     st.warning(f"No data available for {symbol} in the selected date range.")
-            except Exception as e:
-                st.error(f"Error fetching data for {symbol}: {str(e)}")
+        except Exception as e:
+            st.error(f"Error fetching stock data: {str(e)}")
 
     # Remove symbols with no data
     selected_symbols = [symbol for symbol in selected_symbols if symbol in data]
@@ -144,36 +281,20 @@ def main():
     if data:
         with st.spinner('Creating chart...'):
             start_time = time.time()
-            fig = go.Figure()
-            base_symbol = selected_symbols[0]
-            base_data = data[base_symbol]
-            base_start_price = base_data['Close'].iloc[0]
+            y_axis_title = "Percentage Change (%)" if len(selected_symbols) > 1 else "Price (USD)"
 
-            for symbol in selected_symbols:
-                stock_data = data[symbol]
-                start_price = stock_data['Close'].iloc[0]
-
-                if len(selected_symbols) > 1:
-                    # Calculate percentage change relative to the starting point
-                    y_values = ((stock_data['Close'] - start_price) / start_price) * 100
-                    y_axis_title = "Percentage Change (%)"
-                else:
-                    y_values = stock_data['Close']
-                    y_axis_title = "Price (USD)"
+            traces = build_chart_traces(symbols_key, start_date, end_date)
+            longest = max(len(trace['y']) for trace in traces)
+            scatter = go.Scattergl if longest >= SCATTERGL_MIN_POINTS else go.Scatter
+            fig = go.Figure([scatter(x=trace['x'], y=trace['y'], mode='lines', name=trace['name'])
+                             for trace in traces])
 
-                fig.add_trace(go.Scatter(x=stock_data.index, y=y_values, mode='lines', name=f'{symbol}'))
-
-                # Calculate CAGR for the timeframe
-                start_price = stock_data['Close'].iloc[0]
-                end_price = stock_data['Close'].iloc[-1]
-                years = (stock_data.index[-1] - stock_data.index[0]).days / 365.25
-                cagr = ((end_price / start_price) ** (1 / years) - 1) * 100 if years > 0 else 0
-                
+            for trace in traces:
                 # Add annotation for CAGR at the end of the line
                 fig.add_annotation(
-                    x=stock_data.index[-1],
-                    y=y_values.iloc[-1],
-                    text=f"CAGR: {cagr:.2f}%",
+                    x=pd.Timestamp(trace['x'][-1]),
+                    y=float(trace['y'][-1]),
+                    text=f"CAGR: {trace['cagr']:.2f}%",
                     showarrow=True,
                     arrowhead=2,
                     arrowsize=1,
@@ -211,6 +332,10 @@ def main():
 
     # Calculate and display returns
     st.subheader("Returns and Key Metrics")
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        market_cap_futures = {symbol: executor.submit(fetch_market_cap, symbol) for symbol in selected_symbols}
+    cagr_column = f"CAGR ({selected_range})"
+    metrics_rows = []
     for symbol in selected_symbols:
         try:
             stock_data = data[symbol]
@@ -218,30 +343,33 @@ def main():
             total_return, cagr = calculate_returns(stock_data, start_date, end_date)
             
             # Get market cap
-            ticker = yf.Ticker(symbol)
-            market_cap = ticker.info.get('marketCap', 0)
-            if market_cap >= 1e12:
-                formatted_market_cap = f"{market_cap/1e12:.2f}T"
-            elif market_cap >= 1e9:
-                formatted_market_cap = f"{market_cap/1e9:.2f}B"
-            elif market_cap >= 1e6:
-                formatted_market_cap = f"{market_cap/1e6:.2f}M"
-            else:
-                formatted_market_cap = f"{market_cap:.2f}"
-
-            st.markdown(f"**{symbol}**")
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Current Price", f"${current_price:.2f}")
-            with col2:
-                st.metric("Price Performance", f"{total_return:.2%}")
-            with col3:
-                st.metric(f"CAGR ({selected_range})", f"{cagr:.2%}")
-            with col4:
-                st.metric("Market Cap", formatted_market_cap)
+            market_cap = market_cap_futures[symbol].result()
+
+            metrics_rows.append({
+                "Symbol": symbol,
+                "Current Price": float(current_price),
+                "Price Performance": total_return,
+                cagr_column: cagr,
+                "Market Cap": market_cap
+            })
         except Exception as e:
             st.write(f"Error calculating metrics for {symbol}: {str(e)}")
 
+    if metrics_rows:
+        metrics_df = pd.DataFrame(metrics_rows).set_index("Symbol")
+        st.dataframe(metrics_df.style.format({
+            "Current Price": "${:.2f}",
+            "Price Performance": "{:.2%}",
+            cagr_column: "{:.2%}",
+            "Market Cap": format_market_cap
+        }), use_container_width=True)
+        st.download_button(
+            label="Download Metrics",
+            data=export_to_csv(metrics_df),
+            file_name=f"metrics_{selected_range}.csv",
+            mime="text/csv",
+        )
+
     # Historical News Headlines
     st.subheader("Historical News Headlines")
     historical_news_date = st.date_input("Select a date for historical news", 
@@ -249,15 +377,20 @@ def main():
                                          max_value=datetime.now().date(), 
                                          value=datetime.now().date())
     keyword = st.text_input("Enter keyword for news search (optional)")
+    search_query = keyword if keyword else get_company_name(default_symbol)
 
     try:
         with st.spinner('Fetching news headlines...'):
-            data = fetch_news(default_symbol, historical_news_date, keyword)
+            try:
+                data = fetch_news(search_query, historical_news_date)
+            except requests.HTTPError as e:
+                st.error(f"Error fetching news: {e}")
+                data = None
             
             if show_debug:
                 with debug_container.container():
                     st.text(f"Debug - API Response: {data}")
-                    st.text(f"Debug - Search query: {keyword if keyword else get_company_name(default_symbol)}")
+                    st.text(f"Debug - Search query: {search_query}")
                     st.text(f"Debug - Date range: {historical_news_date.strftime('%Y-%m-%d')} to {(historical_news_date + timedelta(days=1)).strftime('%Y-%m-%d')}")
 
             if data and 'response' in data and 'docs' in data['response']:
@@ -266,13 +399,11 @@ def main():
                     news_data = []
                     for article in articles[:5]:  # Display up to 5 articles
                         headline = article['headline']['main'] if 'headline' in article and 'main' in article['headline'] else 'No headline available'
-                        st.write(f"**{headline}**")
-                        st.write(f"Source: The New York Times")
-                        st.write(f"Published at: {article.get('pub_date', 'Date not available')}")
-                        st.write(article.get('abstract', 'No abstract available'))
-                        st.write(f"[Read more]({article.get('web_url', '#')})")
-                        st.write("---")
                         news_data.append([headline, article.get('pub_date', 'Date not available'), article.get('abstract', 'No abstract available'), article.get('web_url', '#')])
+                    st.markdown("".join(
+                        f"**{headline}**\n\nSource: The New York Times\n\nPublished at: {published}\n\n{abstract}\n\n[Read more]({url})\n\n---\n\n"
+                        for headline, published, abstract, url in news_data
+                    ))
                     
                     # Export news data
                     st.subheader("Export News Data")
@@ -284,7 +415,7 @@ def main():
                         mime="text/csv"
                     )
                 else:
-                    st.info(f"No news found for '{keyword if keyword else get_company_name(default_symbol)}' on {historical_news_date}. Try adjusting the date or modifying your search keyword.")
+                    st.info(f"No news found for '{search_query}' on {historical_news_date}. Try adjusting the date or modifying your search keyword.")
             else:
                 st.error(f"Unexpected API response format: {data}")
     except Exception as e: